@@ -6,7 +6,9 @@
 # The YAML description may have the following top-level keys:
 #
 # 'elf_fillchar': char
-#     Sets the fill character to 'char'.
+#     Sets the fill character to 'char'.  With the default of 0, gaps
+#     in the output are left as holes, giving a sparse file where the
+#     file system supports them.
 # 'ehdr': EHDR-DESCRIPTOR
 #     Defines an ELF Ehdr structure.
 # 'phdrtab': list-of(PHDR-DESCRIPTOR)
@@ -84,7 +86,13 @@ usage = "usage: %prog [options] [input-file]"
 description = """Create an ELF binary from a textual description in """ + \
  """'input-file' (or stdin)"""
 
-import io, operator, optparse, re, struct, sys, types, yaml
+import io, mmap, operator, optparse, os, re, stat, struct, sys, types
+import weakref, yaml
+
+try:
+    from yaml import CSafeLoader as YamlLoader  # libyaml based
+except ImportError:
+    from yaml import SafeLoader as YamlLoader
 
 
 class ElfError(Exception):
@@ -123,17 +131,21 @@ class ElfError(Exception):
 # Mappings used by the 'encode()' function
 #
 
-elf_cap_tag = {'CA_SUNW_NULL': 0, 'CA_SUNW_HW_1': 1, 'CA_SUNW_SF_1': 2}
+elf_cap_tag = types.MappingProxyType({
+    'CA_SUNW_NULL': 0,
+    'CA_SUNW_HW_1': 1,
+    'CA_SUNW_SF_1': 2
+})
 
-elf_d_flags = {
+elf_d_flags = types.MappingProxyType({
     'DF_ORIGIN': 0x0001,
     'DF_SYMBOLIC': 0x0002,
     'DF_TEXTREL': 0x0004,
     'DF_BIND_NOW': 0x0006,
     'DF_STATIC_TLS': 0x0010
-}
+})
 
-elf_d_tag = {
+elf_d_tag = types.MappingProxyType({
     # from <sys/elf_common.h>
     'DT_NULL': 0,
     'DT_NEEDED': 1,
@@ -213,22 +225,22 @@ elf_d_tag = {
     'DT_SUNW_AUXILIARY': 0x7ffffffd,
     'DT_SUNW_USED': 0x7ffffffe,
     'DT_SUNW_FILTER': 0x7fffffff
-}
+})
 
 elf_dyn_fields = ['d_tag', 'd_val', 'd_ptr']
 
-elf_ehdr_flags = {  # no known flags
-}
+elf_ehdr_flags = types.MappingProxyType({  # no known flags
+})
 
-elf_ehdr_type = {  # e_type
+elf_ehdr_type = types.MappingProxyType({  # e_type
     'ET_NONE': 0,
     'ET_REL': 1,
     'ET_EXEC': 2,
     'ET_DYN': 3,
     'ET_CORE': 4
-}
+})
 
-elf_ehdr_machine = {  # e_machine
+elf_ehdr_machine = types.MappingProxyType({  # e_machine
     'EM_NONE': 0,
     'EM_M32': 1,
     'EM_SPARC': 2,
@@ -276,18 +288,26 @@ elf_ehdr_machine = {  # e_machine
     'EM_TINYJ': 61,
     'EM_X86_64': 62,
     'EM_ALPHA': 0x9026
-}
+})
 
-elf_ei_version = {  # e_version
+elf_ei_version = types.MappingProxyType({  # e_version
     'EV_NONE': 0,
     'EV_CURRENT': 1
-}
+})
 
-elf_ei_class = {'ELFCLASSNONE': 0, 'ELFCLASS32': 1, 'ELFCLASS64': 2}
+elf_ei_class = types.MappingProxyType({
+    'ELFCLASSNONE': 0,
+    'ELFCLASS32': 1,
+    'ELFCLASS64': 2
+})
 
-elf_ei_data = {'ELFDATANONE': 0, 'ELFDATA2LSB': 1, 'ELFDATA2MSB': 2}
+elf_ei_data = types.MappingProxyType({
+    'ELFDATANONE': 0,
+    'ELFDATA2LSB': 1,
+    'ELFDATA2MSB': 2
+})
 
-elf_ei_osabi = {
+elf_ei_osabi = types.MappingProxyType({
     # Official values.
     'ELFOSABI_NONE': 0,
     'ELFOSABI_HPUX': 1,
@@ -310,16 +330,20 @@ elf_ei_osabi = {
     'ELFOSABI_SYSV': 0,
     'ELFOSABI_LINUX': 3,
     'ELFOSABI_MONTEREY': 7
-}
+})
 
 elf_ph_fields = [
     'p_align', 'p_filesz', 'p_flags', 'p_memsz', 'p_offset', 'p_paddr',
     'p_type', 'p_vaddr'
 ]
 
-elf_ph_flags = {'PF_X': 0x1, 'PF_W': 0x2, 'PF_R': 0x4}
+elf_ph_flags = types.MappingProxyType({
+    'PF_X': 0x1,
+    'PF_W': 0x2,
+    'PF_R': 0x4
+})
 
-elf_ph_type = {
+elf_ph_type = types.MappingProxyType({
     'PT_NULL': 0,
     'PT_LOAD': 1,
     'PT_DYNAMIC': 2,
@@ -338,9 +362,9 @@ elf_ph_type = {
     'PT_SUNWCAP': 0x6FFFFFFD,
     'PT_LOPROC': 0x70000000,
     'PT_HIPROC': 0x7FFFFFFF
-}
+})
 
-elf_sh_type = {
+elf_sh_type = types.MappingProxyType({
     'SHT_NULL': 0,
     'SHT_PROGBITS': 1,
     'SHT_SYMTAB': 2,
@@ -384,9 +408,9 @@ elf_sh_type = {
     # Processor specific types
     'SHT_IA_64_EXT': 0x70000000,
     'SHT_IA_64_UNWIND': 0x70000001
-}
+})
 
-elf_sh_flags = {
+elf_sh_flags = types.MappingProxyType({
     'SHF_WRITE': 0x1,
     'SHF_ALLOC': 0x2,
     'SHF_EXECINSTR': 0x4,
@@ -399,21 +423,29 @@ elf_sh_flags = {
     'SHF_TLS': 0x400,
     'SHF_MASKOS': 0x0ff00000,
     'SHF_MASKPROC': 0xf0000000
-}
+})
 
-elf_st_bindings = {'STB_LOCAL': 0, 'STB_GLOBAL': 1, 'STB_WEAK': 2}
+elf_st_bindings = types.MappingProxyType({
+    'STB_LOCAL': 0,
+    'STB_GLOBAL': 1,
+    'STB_WEAK': 2
+})
 
-elf_st_flags = {'SHF_WRITE': 1, 'SHF_ALLOC': 2, 'SHF_EXECINSTR': 4}
+elf_st_flags = types.MappingProxyType({
+    'SHF_WRITE': 1,
+    'SHF_ALLOC': 2,
+    'SHF_EXECINSTR': 4
+})
 
-elf_st_types = {
+elf_st_types = types.MappingProxyType({
     'STT_NOTYPE': 0,
     'STT_OBJECT': 1,
     'STT_FUNC': 2,
     'STT_SECTION': 3,
     'STT_FILE': 3
-}
+})
 
-elf_syminfo_flags = {
+elf_syminfo_flags = types.MappingProxyType({
     'SYMINFO_FLG_DIRECT': 1,
     'SYMINFO_FLG_PASSTHRU': 2,
     'SYMINFO_FLG_FILTER': 2,  # dup
@@ -422,18 +454,21 @@ elf_syminfo_flags = {
     'SYMINFO_FLG_DIRECTBIND': 0x10,
     'SYMINFO_FLG_NOEXTDIRECT': 0x20,
     'SYMINFO_FLG_AUXILIARY': 0x40
-}
+})
 
-elf_syminfo_boundto_types = {
+elf_syminfo_boundto_types = types.MappingProxyType({
     'SYMINFO_BT_SELF': 0xFFFF,
     'SYMINFO_BT_PARENT': 0xFFFE,
     'SYMINFO_BT_NONE': 0xFFFD,
     'SYMINFO_BT_EXTERN': 0xFFFC
-}
+})
 
 # Defaults
 
 defaults = {
+    # ElfCap structures
+    'c_tag': 0,
+    'c_un': 0,
     # ElfDyn structures
     'd_tag': 'DT_NULL',
     'd_un': '0',
@@ -461,6 +496,12 @@ defaults = {
     'ei_abiversion': '0',
     # File-wide defaults
     'elf_fillchar': '0',
+    # ElfMove structures
+    'm_value': 0,
+    'm_info': 0,
+    'm_poffset': 0,
+    'm_repeat': 0,
+    'm_stride': 0,
     # Elf Notes
     'n_namesz': None,
     'n_descsz': None,
@@ -475,6 +516,10 @@ defaults = {
     'p_paddr': '0',
     'p_type': 'PT_NULL',
     'p_vaddr': '0',
+    # Rel and Rela
+    'r_offset': 0,
+    'r_info': 0,
+    'r_addend': 0,
     # Shdr
     'sh_addr': '0',
     'sh_addralign': None,
@@ -489,6 +534,16 @@ defaults = {
     'sh_size': None,
     'sh_type': 'SHT_NULL',
     'sh_word_size': 32,
+    # Syminfo
+    'si_boundto': 0,
+    'si_flags': 0,
+    # Sym; integers, as strings name entries in string tables
+    'st_info': 0,
+    'st_name': 0,
+    'st_other': 0,
+    'st_shndx': 0,
+    'st_size': 0,
+    'st_value': 0,
     # Verdaux
     'vda_name': 0,
     'vda_next': 0,
@@ -546,47 +601,62 @@ def encode(d, key, default, mapping):
     """Return the numeric value of d[key] in map 'mapping'."""
 
     v = get(d, key, default)
-    try:
-        return mapping[v]
-    except KeyError:
+    t = mapping.get(v)
+    if t is None:
         return int(v)
+    return t
 
 
 def encode_flags(flags, m):
     """Convert 'flags' to a single numeric value using mapping 'm'."""
+    if isinstance(flags, int):
+        return flags
     try:
         v = int(flags)
         return v
-    except:
+    except (OverflowError, TypeError, ValueError):  # a list of flags
         pass
     v = 0
     for f in flags:
-        try:
-            t = int(m[f])
-        except KeyError:
+        t = m.get(f)  # mapped values are already numeric
+        if t is None:
             t = int(f)
         v |= t
     return v
 
 
 def check_dict(d, l, node=None):
-    """Check a dictionary for unknown keys."""
-    unknown = []
-    for k in d.keys():
-        if k not in l:
-            unknown.append(k)
-    if len(unknown) > 0:
+    """Check a dictionary for unknown keys.
+
+    Argument 'l' is a set of the known key names.
+    """
+    unknown = d.keys() - l
+    if unknown:
         raise ElfError(node, "{tag} Unknown key(s) {key}".format(
-            tag=node.tag, key=unknown))
+            tag=node.tag, key=[k for k in d if k in unknown]))
+
 
+def value_mask(encoding):
+    """Return the mask bounding values to the maximum size for a type.
 
-def bounded_value(v, encoding):
-    """Return the value of 'v' bounded to the maximum size for a type."""
+    Unbounded encodings get a mask of -1, which leaves values as is.
+    """
     if encoding == "H":
-        return (v & 0xFFFF)
+        return 0xFFFF
     elif encoding == "I":
-        return (v & 0xFFFFFFFF)
-    return v
+        return 0xFFFFFFFF
+    return -1
+
+
+def make_getter(names):
+    """Return a function that fetches attributes 'names' as a tuple."""
+
+    if len(names) == 0:
+        return lambda o: ()
+    if len(names) == 1:  # attrgetter() returns a bare value here
+        g = operator.attrgetter(names[0])
+        return lambda o: (g(o), )
+    return operator.attrgetter(*names)
 
 
 #
@@ -603,7 +673,9 @@ class ElfStrTab:
     def __init__(self, strs=None):
         """Initialize a string table from a list of strings."""
         self.offset = 1  # reserve space for initial null byte
-        self.htab = {}
+        self.htab = {}  # string -> offset
+        self._order = [b""]  # encoded strings in offset order; initial NUL
+        self._bits = None  # cached result of bits()
         if isinstance(strs, str):  # one string
             self.add(strs)
         elif isinstance(strs, list):  # list of strings
@@ -614,21 +686,24 @@ class ElfStrTab:
         """Add a string to the string table.
 
         Returns the offset of the string in the ELF section."""
-        try:
-            return self.lookup(s)
-        except KeyError:
-            self.htab[s] = offset = self.offset
-            self.offset += len(s) + 1  # Keep space for a NUL.
+        offset = self.htab.get(s)
+        if offset is not None:
+            return offset
+        b = s.encode('utf-8')
+        self.htab[s] = offset = self.offset
+        self._order.append(b)
+        self._bits = None
+        self.offset += len(b) + 1  # Keep space for a NUL.
         return offset
 
     def bits(self):
         """Return the contents of an ELF string table."""
 
-        # Prepare the string table, ordered by string offset.
-        ls = [b""]  # initial NUL
-        for (ss, oo) in sorted(self.htab.items(), key=operator.itemgetter(1)):
-            ls.append(bytes(ss, 'utf-8'))
-        return b"\000".join(ls) + b"\000"  # Add trailing NULs
+        # Offsets are handed out in insertion order, so '_order' is
+        # already sorted by string offset.
+        if self._bits is None:
+            self._bits = b"\000".join(self._order) + b"\000"  # trailing NUL
+        return self._bits
 
     def lookup(self, str):
         """Return the ELF string table offset for string 'str'."""
@@ -636,6 +711,11 @@ class ElfStrTab:
         return self.htab[str]
 
 
+# String tables with identical contents share one ElfStrTab.  Tables
+# are not added to after construction, so sharing is safe.
+_strtab_cache = weakref.WeakValueDictionary()  # tuple(strs) -> ElfStrTab
+
+
 class ElfType:
     """A base type for ELF type descriptors.
 
@@ -646,7 +726,10 @@ class ElfType:
         'name' is the name of a field in the ELF structure.
 
         'fn' is a convertor function, one of the functions
-        'do_{long,encode,flags}' below.
+        'do_{long,encode,flags}' below.  It is called as
+        'fn(d, name, default)', where 'default' is the field's entry
+        in 'defaults', looked up once per class.  Every field must
+        have an entry in 'defaults'.
 
         'msz' and 'lsz' provide the appropriate sizes when
         generating a binary representation of the type.
@@ -654,6 +737,36 @@ class ElfType:
 
     fields = None
 
+    # Pad bytes following the fields in the file representation.
+    _padding = ""
+
+    def __init_subclass__(cls, **kwargs):
+        """Precompute per-class data derived from 'fields'."""
+
+        super().__init_subclass__(**kwargs)
+        # Parallel tuples of field names, convertors and defaults, in
+        # 'fields' order, plus the set of names for key checks.
+        cls._field_names = tuple(t[0] for t in cls.fields)
+        cls._field_fns = tuple(t[1] for t in cls.fields)
+        cls._field_defaults = tuple(defaults[t[0]] for t in cls.fields)
+        cls._field_set = frozenset(cls._field_names)
+
+        # The file representation, keyed by (formatchar, index of the
+        # size entry in 'fields'): a compiled 'struct.Struct', an
+        # accessor for the fields present in the file and their value
+        # masks, so that emitting a record takes a single lookup.
+        # Types such as ElfPhdr lay themselves out and carry no sizes.
+        cls._packers = {}
+        if all(len(t) == 4 for t in cls.fields):
+            for n in (2, 3):
+                encoded = [t for t in cls.fields if t[n] != ""]
+                getter = make_getter([t[0] for t in encoded])
+                masks = tuple(value_mask(t[n]) for t in encoded)
+                format = "".join(t[n] for t in encoded) + cls._padding
+                for c in "<>":
+                    cls._packers[(c, n)] = \
+                        (struct.Struct(c + format), getter, masks)
+
     def __init__(self, d, node):
         """Initialize an ELF datatype from a YAML description.
 
@@ -663,18 +776,18 @@ class ElfType:
         node    -- YAML parser node for this element.
         """
 
-        keys = [t[0] for t in self.fields]
-        check_dict(d, keys, node)
-        for f in self.fields:
-            name = f[0]
-            fn = f[1]
-            try:
-                v = fn(d, name)
-                setattr(self, f[0], v)
-            except:
-                raise ElfError(
-                    node, "key: {key!r} value: {value!r} unrecognized.".format(
-                        key=name, value=d[name]))
+        check_dict(d, self._field_set, node)
+        values = []
+        try:
+            for (name, fn, default) in zip(self._field_names,
+                                           self._field_fns,
+                                           self._field_defaults):
+                values.append(fn(d, name, default))
+        except (KeyError, OverflowError, TypeError, ValueError):
+            raise ElfError(
+                node, "key: {key!r} value: {value!r} unrecognized.".format(
+                    key=name, value=d[name]))
+        self.__dict__.update(zip(self._field_names, values))
         self._n = node  # Save YAML node and associated value
         self._d = d  # for error reporting.
 
@@ -686,32 +799,44 @@ class ElfType:
     def bits(self, formatchar, elfclass):
         """Convert an ELF type to its file representation."""
 
-        format, args = self.getfields(elfclass)
-        return struct.pack(formatchar + format, *args)
+        p, args = self.getfields_packer(formatchar, elfclass)
+        return p.pack(*args)
 
-    def formatstring(self, elfclass):
-        """Return the format string for this type."""
+    @classmethod
+    def table_bits(cls, items, formatchar, elfclass):
+        """Return the file representation of a list of 'cls' objects.
 
-        if elfclass == ELFCLASS32:
-            n = 2
-        else:
-            n = 3
-        return "".join([t[n] for t in self.fields])
+        The records are packed with a single 'struct' call over a
+        repeated format.  Types with their own bits() are joined
+        record by record instead.
+        """
+
+        if cls.bits is not ElfType.bits:
+            return b"".join([o.bits(formatchar, elfclass) for o in items])
+        if len(items) == 0:
+            return b""
+        values = []
+        for o in items:
+            p, args = o.getfields_packer(formatchar, elfclass)
+            values.extend(args)
+        return struct.pack(formatchar + p.format[1:] * len(items), *values)
 
-    def content(self, elfclass):
-        """Return a tuple containing the values for an ELF type."""
+    def packer(self, formatchar, elfclass):
+        """Return the compiled 'struct.Struct' for the layout of this type."""
 
-        a = []
         if elfclass == ELFCLASS32:
-            n = 2
-        else:
-            n = 3
-        for t in self.fields:
-            field_encoding = t[n]
-            if field_encoding != "":
-                v = getattr(self, t[0])
-                a.append(bounded_value(v, field_encoding))
-        return tuple(a)
+            return self._packers[(formatchar, 2)][0]
+        return self._packers[(formatchar, 3)][0]
+
+    def getfields_packer(self, formatchar, elfclass):
+        """Return the 'struct.Struct' for this type and the values to pack.
+
+        Types with a class-dependent field order override this.
+        """
+
+        n = 2 if elfclass == ELFCLASS32 else 3
+        p, getter, masks = self._packers[(formatchar, n)]
+        return (p, [v & m for v, m in zip(getter(self), masks)])
 
     def getfields(self, elfclass):
         """Describe the binary layout of the type.
@@ -721,13 +846,21 @@ class ElfType:
         python library module.
         """
 
-        return (self.formatstring(elfclass), self.content(elfclass))
+        p, args = self.getfields_packer("<", elfclass)
+        return (p.format[1:], tuple(args))
 
     def layout(self, offset, elf):
         """Perform any layout-time translation for an ELF type."""
 
         return offset
 
+    @classmethod
+    def layout_table(cls, items, offset, elf):
+        """Perform layout-time translation for a list of 'cls' objects."""
+
+        for o in items:
+            o.layout(offset, elf)
+
     def size(self, elfclass):
         """Return the size of the type in bytes.
 
@@ -735,22 +868,7 @@ class ElfType:
         the type.
         """
 
-        format = self.formatstring(elfclass)
-        sz = 0
-        for f in format:
-            if f == "B":
-                sz += 1
-            elif f == "H":
-                sz += 2
-            elif f == "I":
-                sz += 4
-            elif f == "Q":
-                sz += 8
-            elif f == "":
-                pass
-            else:
-                raise TypeError("Invalid format char {char!r}.".format(char=f))
-        return sz
+        return self.packer("<", elfclass).size  # no alignment padding
 
 
 #
@@ -758,41 +876,43 @@ class ElfType:
 #
 
 
-def do_string(d, n):
+def do_string(d, n, default):
     """Convert a YAML value to a Python string."""
 
-    v = get(d, n, defaults[n])
+    v = get(d, n, default)
     if v:
         return str(v)
     return v
 
 
-def do_long(d, n):
+def do_long(d, n, default):
     """Convert a YAML value to a Python 'long'."""
 
-    v = get(d, n, defaults[n])
+    v = get(d, n, default)
     if v:
         return int(v)
     return v
 
 
-def do_copy(d, n):
+def do_copy(d, n, default):
     """Copy a YAML value without conversion."""
 
-    v = get(d, n, defaults[n])
+    v = get(d, n, default)
     return v
 
 
 def do_encode(xlate):
     """Translate a YAML value according to mapping 'xlate'."""
 
-    return lambda d, n, xl=xlate: encode(d, n, defaults[n], xl)
+    xl = dict(xlate)  # plain dict lookups beat the read-only view
+    return lambda d, n, default: encode(d, n, default, xl)
 
 
 def do_flags(xlate):
     """Translate a list of flags according to mapping 'xlate'."""
 
-    return lambda d, n, xl=xlate: encode_flags(get(d, n, defaults[n]), xl)
+    xl = dict(xlate)  # plain dict lookups beat the read-only view
+    return lambda d, n, default: encode_flags(get(d, n, default), xl)
 
 
 #
@@ -847,14 +967,13 @@ class ElfEhdrIdent(ElfType):
         ('ei_abiversion', do_long, "B", "B")
     ]
 
+    _padding = 'xxxxxxx'
+
     def __init__(self, ei, node):
         ElfType.__init__(self, ei, node)
 
     def bits(self, format, elfclass):
-        f, args = self.getfields(elfclass)
-        s = b"\x7FELF"
-        s += struct.pack(f + 'xxxxxxx', *args)
-        return s
+        return b"\x7FELF" + ElfType.bits(self, format, elfclass)
 
 
 class ElfEhdr(ElfType):
@@ -990,15 +1109,17 @@ class ElfEhdr(ElfType):
     def bits(self, formatchar, elfclass):
         """Return the file representation of an Elf Ehdr."""
 
-        s = self.e_ident.bits(formatchar, elfclass)
-        s += ElfType.bits(self, formatchar, elfclass)
-
-        return s
+        return b"".join((self.e_ident.bits(formatchar, elfclass),
+                         ElfType.bits(self, formatchar, elfclass)))
 
 
 class ElfLong:
     """Wrapper around a python Int/Long."""
 
+    # Packers keyed by (formatchar, needs 64 bits).
+    _packers = {(c, wide): struct.Struct(c + ("Q" if wide else "I"))
+                for c in "<>" for wide in (False, True)}
+
     def __init__(self, v):
         self._v = int(v)
 
@@ -1010,11 +1131,7 @@ class ElfLong:
         8 bytes wide.
         """
 
-        if self._v > 0xFFFFFFFF:
-            f = formatchar + "Q"
-        else:
-            f = formatchar + "I"
-        return struct.pack(f, self._v)
+        return self._packers[(formatchar, self._v > 0xFFFFFFFF)].pack(self._v)
 
 
 class ElfMove(ElfType):
@@ -1063,22 +1180,24 @@ class ElfNote(ElfType):
 
     def layout(self, offset, elfclass):
         if len(self.n_data) != 2:
-            raise ElfError(node, "Note data not a pair of strings.")
+            raise ElfError(self._n, "Note data not a pair of strings.")
 
         for nd in self.n_data:
             if isinstance(nd, ElfType):
                 nd.layout(offset, elfclass)
 
+        # Encode the name and description once; sizes are in bytes.
+        self._nb = str(self.n_data[0]).encode('utf-8')
+        self._db = str(self.n_data[1]).encode('utf-8')
+
         if self.n_namesz is None:
-            self.n_namesz = len(self.n_data[0])
+            self.n_namesz = len(self._nb)
         if self.n_descsz is None:
-            self.n_descsz = len(self.n_data[1])
+            self.n_descsz = len(self._db)
 
     def bits(self, format, elfclass):
-        b = ElfType.bits(self, format, elfclass)
-        nbits = str(self.n_data[0])
-        dbits = str(self.n_data[1])
-        return b + nbits + dbits
+        return b"".join((ElfType.bits(self, format, elfclass), self._nb,
+                         self._db))
 
 
 class ElfPhdr(ElfType):
@@ -1115,22 +1234,22 @@ class ElfPhdr(ElfType):
          "memsz:%(p_memsz)ld)" % self
         return s
 
-    def bits(self, formatchar, elfclass):
-        """Return the file representation of a Phdr."""
+    # Phdr structures are laid out in a class-dependent way
+    _packers32 = {c: struct.Struct(c + "IIIIIIII") for c in "<>"}
+    _packers64 = {c: struct.Struct(c + "IIQQQQQQ") for c in "<>"}
+    _getter32 = operator.attrgetter('p_type', 'p_offset', 'p_vaddr',
+                                    'p_paddr', 'p_filesz', 'p_memsz',
+                                    'p_flags', 'p_align')
+    _getter64 = operator.attrgetter('p_type', 'p_flags', 'p_offset',
+                                    'p_vaddr', 'p_paddr', 'p_filesz',
+                                    'p_memsz', 'p_align')
+
+    def getfields_packer(self, formatchar, elfclass):
+        """Return the 'struct.Struct' and values for this Phdr."""
 
-        f = formatchar
-        # Phdr structures are laid out in a class-dependent way
         if elfclass == ELFCLASS32:
-            f += "IIIIIIII"
-            s = struct.pack(f, self.p_type, self.p_offset, self.p_vaddr,
-                            self.p_paddr, self.p_filesz, self.p_memsz,
-                            self.p_flags, self.p_align)
-        else:
-            f += "IIQQQQQQ"
-            s = struct.pack(f, self.p_type, self.p_flags, self.p_offset,
-                            self.p_vaddr, self.p_paddr, self.p_filesz,
-                            self.p_memsz, self.p_align)
-        return s
+            return (self._packers32[formatchar], self._getter32(self))
+        return (self._packers64[formatchar], self._getter64(self))
 
 
 class ElfRel(ElfType):
@@ -1219,6 +1338,8 @@ class ElfSection(ElfType):
                 node,
                 "unsupported 'sh_word_size' value: {v!r}".format(
                     v=self.sh_word_size))
+        # mask for rounding offsets up to 'sh_addralign'
+        self._align_mask = self.sh_addralign - 1 if self.sh_addralign else 0
         self._data = None  # 'cache' of translated data
         self._strtab = None
 
@@ -1235,7 +1356,11 @@ class ElfSection(ElfType):
     def make_strtab(self):
         """Create a string table from section contents."""
 
-        self._strtab = ElfStrTab(self.sh_data)
+        key = tuple(self.sh_data)
+        self._strtab = _strtab_cache.get(key)
+        if self._strtab is None:
+            self._strtab = ElfStrTab(self.sh_data)
+            _strtab_cache[key] = self._strtab
 
     def string_to_index(self, name):
         """Convert 'name' to an offset inside a string table.
@@ -1268,21 +1393,23 @@ class ElfSection(ElfType):
                         "Section name {name!r} not in string table.".format(
                             name=self.sh_name))
         # give a chance for the contents of a section to xlate strings
-        for d in self.sh_data:
-            if isinstance(d, ElfType):
-                d.layout(offset, elf)
-        # compute the space used by the section data
-        self._data = self.databits(elf.formatchar(), elf.elfclass())
-
-        align = self.sh_addralign
-        if align == 0:
-            align = 1
+        t = self._item_type()
+        if t is not None and issubclass(t, ElfType):
+            t.layout_table(self.sh_data, offset, elf)
+        else:
+            for d in self.sh_data:
+                if isinstance(d, ElfType):
+                    d.layout(offset, elf)
         if self.sh_type == SHT_NULL or self.sh_type == SHT_NOBITS:
             isnulltype = 1
+            self._data = b""  # no file contents
         else:
             isnulltype = 0
+            # compute the space used by the section data
+            self._data = self.databits(elf.formatchar(), elf.elfclass())
 
-        offset = (offset + (align - 1)) & ~(align - 1)
+        mask = self._align_mask
+        offset = (offset + mask) & ~mask
         if self.sh_size is None:
             if isnulltype:
                 self.sh_size = 0
@@ -1297,27 +1424,57 @@ class ElfSection(ElfType):
             return offset
         return offset + len(self._data)
 
+    def _item_type(self):
+        """Return the type shared by all items of 'sh_data', or None."""
+
+        if not self.sh_data:
+            return None
+        t = type(self.sh_data[0])
+        if all(type(d) is t for d in self.sh_data):
+            return t
+        return None
+
     def databits(self, formatchar, elfclass):
         """Return the contents of a section."""
 
-        if self._data:
+        if self._data is not None:
             return self._data
         # special-case string table handling
         if self.sh_type == SHT_STRTAB:
-            return self._strtab.bits()
+            self._data = self._strtab.bits()
+            return self._data
+        # tables of a single record type are packed in one call, and
+        # plain text is encoded in one go
+        t = self._item_type()
+        if t is str:
+            self._data = "".join(self.sh_data).encode('utf-8')
+            return self._data
+        if t is not None and issubclass(t, ElfType):
+            self._data = t.table_bits(self.sh_data, formatchar, elfclass)
+            return self._data
         # 'normal' section
-        s = b""
+        word_size_char = "I"
+        if self.sh_word_size == 64:
+            word_size_char = "Q"
+        parts = []
+        words = []  # pending run of integers, packed together
         for d in self.sh_data:
+            if isinstance(d, int):
+                words.append(d)
+                continue
+            if words:
+                parts.append(struct.pack(
+                    formatchar + word_size_char * len(words), *words))
+                words = []
             if isinstance(d, ElfType):
-                s += d.bits(formatchar, elfclass)
-            elif isinstance(d, int):
-                word_size_char = "I"
-                if self.sh_word_size == 64:
-                    word_size_char = "Q"
-                s += struct.pack(formatchar + word_size_char, d)
+                parts.append(d.bits(formatchar, elfclass))
             else:
-                s += bytes(d, 'utf-8')
-        return s
+                parts.append(d.encode('utf-8'))
+        if words:
+            parts.append(struct.pack(
+                formatchar + word_size_char * len(words), *words))
+        self._data = b"".join(parts)
+        return self._data
 
     def headerbits(self, formatchar, elfclass):
         """Return the file representation of the section header."""
@@ -1341,21 +1498,23 @@ class ElfSym(ElfType):
         ('st_value', do_long, "I", "Q")
     ]
 
+    # Sym structures are laid out in a class-dependent way
+    _packers32 = {c: struct.Struct(c + "IIIBBH") for c in "<>"}
+    _packers64 = {c: struct.Struct(c + "IBBHQQ") for c in "<>"}
+    _getter32 = operator.attrgetter('st_name', 'st_value', 'st_size',
+                                    'st_info', 'st_other', 'st_shndx')
+    _getter64 = operator.attrgetter('st_name', 'st_info', 'st_other',
+                                    'st_shndx', 'st_value', 'st_size')
+
     def __init__(self, sym, node):
         ElfType.__init__(self, sym, node)
 
-    def bits(self, format, elfclass):
-        """Return the file representation for an ELF Sym."""
+    def getfields_packer(self, format, elfclass):
+        """Return the 'struct.Struct' and values for this Sym."""
 
         if elfclass == ELFCLASS32:
-            s = struct.pack(format + "IIIBBH", self.st_name, self.st_value,
-                            self.st_size, self.st_info, self.st_other,
-                            self.st_shndx)
-        else:
-            s = struct.pack(format + "IBBHQQ", self.st_name, self.st_info,
-                            self.st_other, self.st_shndx, self.st_value,
-                            self.st_size)
-        return s
+            return (self._packers32[format], self._getter32(self))
+        return (self._packers64[format], self._getter64(self))
 
     def layout(self, offset, elf):
         """Perform layout-time conversions for an ELF Sym.
@@ -1364,19 +1523,45 @@ class ElfSym(ElfType):
         string tables.
         """
 
+        self._resolve(elf, {}, {})
+        return offset
+
+    @classmethod
+    def layout_table(cls, syms, offset, elf):
+        """Perform layout-time conversions for a table of Syms.
+
+        Section names and string tables are looked up once per
+        distinct 'st_shndx' value and shared by the whole table.
+        """
+
+        indices = {}  # section name -> section index
+        strtabs = {}  # section index -> string table
+        for sym in syms:
+            sym._resolve(elf, indices, strtabs)
+
+    def _resolve(self, elf, indices, strtabs):
+        """Convert string valued fields, memoizing lookups."""
+
         if isinstance(self.st_shndx, str):
-            self.st_shndx = \
-                  elf.elf_sections.get_index(self.st_shndx)
-            if self.st_shndx is None:
+            name = self.st_shndx
+            try:
+                shndx = indices[name]
+            except KeyError:
+                shndx = indices[name] = elf.elf_sections.get_index(name)
+            if shndx is None:
                 raise ElfError(self._n, "Untranslateable 'st_shndx' " + \
-                 "value {value!r}.".format(value=self.st_shndx))
+                 "value {value!r}.".format(value=name))
+            self.st_shndx = shndx
 
         if isinstance(self.st_name, str):
             try:
-                strtab = \
-                       elf.elf_sections[self.st_shndx]._strtab
-            except IndexError:
-                raise ElfError(self._n, "'st_shndx' out of range")
+                strtab = strtabs[self.st_shndx]
+            except KeyError:
+                try:
+                    strtab = elf.elf_sections[self.st_shndx]._strtab
+                except IndexError:
+                    raise ElfError(self._n, "'st_shndx' out of range")
+                strtabs[self.st_shndx] = strtab
             if strtab is None:
                 raise ElfError(self._n, "'st_shndx' not of type STRTAB.")
 
@@ -1386,7 +1571,6 @@ class ElfSym(ElfType):
                 raise ElfError(
                     self._n,
                     "unknown string {string!r}".format(string=self.st_name))
-        return offset
 
 
 class ElfSyminfo(ElfType):
@@ -1497,10 +1681,7 @@ class ElfPhdrTable:
     def bits(self, formatchar, elfclass):
         """Return the file representation of the Phdr table."""
 
-        s = ""
-        for d in self.pht_data:
-            s += d.bits(formatchar, elfclass)
-        return s
+        return ElfPhdr.table_bits(self.pht_data, formatchar, elfclass)
 
     def __len__(self):
         """Return the number of program header table entries."""
@@ -1524,17 +1705,19 @@ class ElfSectionList:
         """
 
         self.shl_sections = shlist
-        self.shl_sectionnames = []
         self.shl_nentries = len(shlist)
+        self._by_index = None  # sh_index -> section, built on demand
+        self._name_index = {}  # section name -> section index
 
-        for sh in shlist:
+        for (i, sh) in enumerate(shlist):
             if not isinstance(sh, ElfSection):
                 raise ElfError(None, """Section 'sections' contains
                            unrecognized data.""")
             if sh.sh_index is not None:
                 if self.shl_nentries <= sh.sh_index:
                     self.shl_nentries = sh.sh_index + 1
-            self.shl_sectionnames.append((sh.sh_name, sh.sh_index))
+            self._name_index.setdefault(
+                sh.sh_name, sh.sh_index if sh.sh_index is not None else i)
             if sh.sh_type == SHT_STRTAB:  # a string table
                 sh.make_strtab()
 
@@ -1554,9 +1737,16 @@ class ElfSectionList:
         try:
             return self.shl_sections[ind]
         except IndexError:
+            pass
+        # Symbols and section names resolve their string table through
+        # here, so remember explicitly indexed sections after one scan.
+        if self._by_index is None:
+            self._by_index = {}
             for sh in self.shl_sections:
-                if sh.sh_index == ind:
-                    return sh
+                self._by_index.setdefault(sh.sh_index, sh)
+        try:
+            return self._by_index[ind]
+        except KeyError:
             raise IndexError("no section at index {index}".format(index=ind))
 
     def layout(self, offset, elf):
@@ -1571,15 +1761,7 @@ class ElfSectionList:
     def get_index(self, name):
         """Return the section index for section 'name', or 'None'."""
 
-        c = 0
-        for (n, i) in self.shl_sectionnames:
-            if n == name:
-                if i is None:
-                    return c
-                else:
-                    return i
-            c += 1
-        return None
+        return self._name_index.get(name)
 
     def get_shnum(self):
         """Retrieve the number of sections in this container."""
@@ -1610,6 +1792,11 @@ class Elf:
         self.elf_sections = sections
         self.elf_fillchar = int(
             get(yamldict, 'elf_fillchar', defaults['elf_fillchar']))
+        if not 0 <= self.elf_fillchar <= 0xFF:
+            raise ElfError(
+                None, "'elf_fillchar' {v!r} does not fit in a byte.".format(
+                    v=self.elf_fillchar))
+        self._fillbytes = bytes([self.elf_fillchar])
 
     def byteorder(self):
         """Return the byteorder for this ELF object."""
@@ -1647,49 +1834,73 @@ class Elf:
 
         Argument 'fn' denotes the destination."""
 
-        of = io.open(fn, 'wb')
-
         formatchar = self.formatchar()
         elfclass = self.elfclass()
 
-        # Write out the header
-        of.write(self.elf_ehdr.bits(formatchar, elfclass))
+        # Collect (offset, bits) pairs in write order; later pieces
+        # overwrite earlier ones where they overlap.
+        pieces = [(0, self.elf_ehdr.bits(formatchar, elfclass))]
 
-        # Write out the program header table if present
+        # The program header table if present
         if self.elf_phdrtab:
-            self.reposition(of, self.elf_ehdr.e_phoff)
-            for ph in self.elf_phdrtab:
-                of.write(ph.bits(formatchar, elfclass))
-        # Write out the sections
+            pieces.append((self.elf_ehdr.e_phoff,
+                           self.elf_phdrtab.bits(formatchar, elfclass)))
+        # The sections
         if self.elf_sections:
             # First the contents of the sections
             for sh in self.elf_sections:
                 if sh.sh_type == SHT_NULL or sh.sh_type == SHT_NOBITS:
                     continue
-                self.reposition(of, sh.sh_offset)
-                of.write(sh.databits(formatchar, elfclass))
-            # Then the header table
-            self.reposition(of, self.elf_ehdr.e_shoff)
+                pieces.append((sh.sh_offset, sh.databits(formatchar,
+                                                         elfclass)))
+            # Then the header table, one piece per header so that gaps
+            # between headers are left alone
+            offset = self.elf_ehdr.e_shoff
             for sh in self.elf_sections:
                 if sh.sh_index:
-                    new_offset = sh.sh_index * self.elf_ehdr.e_shentsize + \
+                    offset = sh.sh_index * self.elf_ehdr.e_shentsize + \
                      self.elf_ehdr.e_shoff
-                    self.reposition(of, new_offset)
-                of.write(sh.headerbits(formatchar, elfclass))
-        of.close()
-
-    def reposition(self, f, offset):
-        """Reposition file `f' to offset `offset', filling gaps with
-        the configured fill character as needed."""
-
-        pos = f.tell()
-        if offset == pos:
-            return
-        if offset < pos or (offset > pos and self.elf_fillchar == 0):
-            f.seek(offset, 0)
+                b = sh.headerbits(formatchar, elfclass)
+                pieces.append((offset, b))
+                offset += len(b)
+
+        # Size the output file and map it, so that pieces are copied
+        # straight into the page cache.  The fill character is laid
+        # down first, a bounded chunk at a time, so gaps need no
+        # further work.  Extending the file reads back as zeros, so a
+        # zero fill is skipped and untouched pages stay holes.
+        size = max([off + len(b) for (off, b) in pieces if b])
+        try:
+            mappable = stat.S_ISREG(os.stat(fn).st_mode)
+        except OSError:  # does not exist yet; created as a regular file
+            mappable = True
+        if not mappable:
+            # Devices and pipes cannot be sized or mapped, so the image
+            # is assembled and written a bounded window at a time; a
+            # large gap, such as a far 'sh_index' slot, is not held in
+            # memory all at once.
+            window = 1 << 20
+            with io.open(fn, 'wb') as of:
+                for start in range(0, size, window):
+                    end = min(start + window, size)
+                    image = bytearray(self._fillbytes * (end - start))
+                    for (off, b) in pieces:
+                        lo = max(off, start)
+                        hi = min(off + len(b), end)
+                        if lo < hi:
+                            image[lo - start:hi - start] = b[lo - off:hi - off]
+                    of.write(image)
             return
-        s = ("{fillchar}".format(fillchar=self.elf_fillchar) * (offset - pos))
-        f.write(s)
+        with io.open(fn, 'w+b') as of:
+            of.truncate(size)
+            with mmap.mmap(of.fileno(), size) as image:
+                if self.elf_fillchar != 0:
+                    chunk = self._fillbytes * min(size, 1 << 20)
+                    for off in range(0, size, len(chunk)):
+                        image[off:off + len(chunk)] = chunk[:size - off]
+                for (off, b) in pieces:
+                    image[off:off + len(b)] = b
+                image.flush()
 
 
 #
@@ -1721,7 +1932,7 @@ def init_parser():
     for t in yaml_tags:
         yaml.add_constructor(t[0], # lamdba: loader, node, class
          lambda l, n, c=t[1]: \
-          c(l.construct_mapping(n, deep=True), n))
+          c(l.construct_mapping(n, deep=True), n), Loader=YamlLoader)
 
 
 def make_elf(yd):
@@ -1777,18 +1988,19 @@ if __name__ == '__main__':
     if len(args) > 1:
         parser.error("only one input-file must be specified")
 
+    # The loader is handed bytes; libyaml does its own decoding.
     try:
         if args:
-            stream = io.open(args[0], 'r')
+            stream = io.open(args[0], 'rb')
         else:
-            stream = sys.stdin
+            stream = sys.stdin.buffer
     except IOError as err:
         parser.error("cannot open stream: {err}".format(err=err))
 
     init_parser()
 
     try:
-        elf = make_elf(yaml.load(stream, Loader=yaml.Loader))
+        elf = make_elf(yaml.load(stream, Loader=YamlLoader))
         elf.layout()
         elf.write(options.output)
     except yaml.YAMLError as err:
@@ -94,6 +94,33 @@ let negative_tests =
     };
   ]
 
+type section_names_test_desc = {
+  spec_path : string;
+  section_names : string list;
+}
+
+(* Section names following a non-ASCII name must resolve to the right
+   string table offset *)
+let section_names_tests =
+  [
+    {
+      spec_path = "test-files/valid-elf-descriptions/strtab-utf8-LSB-32.yaml";
+      section_names = [ ".données"; ".bar"; ".shstrtab" ];
+    };
+    {
+      spec_path = "test-files/valid-elf-descriptions/strtab-utf8-LSB-64.yaml";
+      section_names = [ ".données"; ".bar"; ".shstrtab" ];
+    };
+    {
+      spec_path = "test-files/valid-elf-descriptions/strtab-utf8-MSB-32.yaml";
+      section_names = [ ".données"; ".bar"; ".shstrtab" ];
+    };
+    {
+      spec_path = "test-files/valid-elf-descriptions/strtab-utf8-MSB-64.yaml";
+      section_names = [ ".données"; ".bar"; ".shstrtab" ];
+    };
+  ]
+
 (* Run command after redirecting stdout and stderr to specified files *)
 let run_cmd_with_redirects cmd_array stdout_path stderr_path =
   let new_stdout = Unix.descr_of_out_channel (open_out stdout_path)
@@ -190,6 +217,25 @@ let run_negative_tests () =
   let succ = negative_tests |> List.filter_map aux |> List.length in
   (total, total - succ)
 
+(* Ensure that Owl reads back the expected section names *)
+let run_section_names_tests () =
+  let total = List.length section_names_tests
+  and same_names expected sections =
+    let names = List.map (fun s -> s.Owl.Ofile.name) sections in
+    List.length names = List.length expected
+    && List.for_all2 String.equal names expected
+  in
+  let aux test_desc =
+    Printf.printf "%s" (fmt_test_name test_desc.spec_path);
+    match run_elf_spec_pipeline test_desc.spec_path with
+    | Ok (_, _, sections) ->
+        if same_names test_desc.section_names sections then succ ()
+        else fail ()
+    | Error _ -> fail ()
+  in
+  let succ = section_names_tests |> List.filter_map aux |> List.length in
+  (total, total - succ)
+
 let () =
   Printf.printf "Running positive tests ...\n";
   let ptotal, pfail =
@@ -199,10 +245,16 @@ let () =
   Printf.printf "\nRunning negative tests ...\n";
   let ntotal, nfail = run_negative_tests () in
 
+  Printf.printf "\nRunning section name tests ...\n";
+  let stotal, sfail = run_section_names_tests () in
+
   Printf.printf "\nSummary (%d positive tests):\n" ptotal;
   Printf.printf " - failed: %u\n" pfail;
 
   Printf.printf "\nSummary (%d negative tests):\n" ntotal;
   Printf.printf " - failed: %u\n" nfail;
 
-  if pfail > 0 || nfail > 0 then exit 1
+  Printf.printf "\nSummary (%d section name tests):\n" stotal;
+  Printf.printf " - failed: %u\n" sfail;
+
+  if pfail > 0 || nfail > 0 || sfail > 0 then exit 1